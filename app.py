@@ -1,7 +1,7 @@
 # app.py
 import streamlit as st
 import pandas as pd
-from rag import RAGPipeline 
+from rag import RAGPipeline, create_embeddings, load_chroma, create_llm, create_sql_agent
 
 # ---------- CONFIGURATION ----------
 PAGE_TITLE = "NuPIE Insights"
@@ -31,9 +31,32 @@ with col2:
 st.divider()
 
 # --- Pipeline Initialization ---
+# Each resource is cached separately so a reload only rebuilds what changed.
 @st.cache_resource
+def _get_embeddings():
+    return create_embeddings()
+
+@st.cache_resource
+def _get_chroma(_embeddings):
+    return load_chroma(_embeddings)
+
+@st.cache_resource
+def _get_llm():
+    return create_llm()
+
+@st.cache_resource
+def _get_sql_agent(_llm):
+    return create_sql_agent(_llm)
+
 def initialize_pipeline():
-    return RAGPipeline()
+    embeddings = _get_embeddings()
+    llm = _get_llm()
+    return RAGPipeline.from_parts(
+        embeddings=embeddings,
+        db=_get_chroma(embeddings),
+        llm=llm,
+        sql_agent=_get_sql_agent(llm)
+    )
 
 pipeline = initialize_pipeline()
 
@@ -43,7 +66,32 @@ if "messages" not in st.session_state:
     
 
 # --- Message Rendering ---
-def render_message(role, content, sources=None):
+@st.cache_data
+def _as_df(rows: tuple) -> pd.DataFrame:
+    # Keyed on an immutable view of the rows, so history reruns reuse the built frame
+    return pd.DataFrame([dict(r) for r in rows])
+
+def render_sources(sources, msg_id):
+    # Sources are only built when the user opens them; the toggle state survives reruns
+    if not st.toggle("View Sources / Raw Data", key=f"sources_{msg_id}"):
+        return
+
+    with st.container(border=True):
+        for i, s in enumerate(sources):
+            st.caption(f"**Source {i+1}:** `{s.get('source', 'Unknown')}`")
+            
+            if s.get("type") == "sql":
+                try:
+                    df = _as_df(tuple(tuple(r.items()) for r in s["content"]))
+                    st.dataframe(df)
+                except Exception:
+                    st.code(str(s["content"]))
+            else:
+                st.text(s["content"])
+            
+            st.divider()
+
+def render_message(role, content, sources=None, msg_id=None):
     if role == "user":
         avatar = "👤" 
     else:
@@ -53,24 +101,12 @@ def render_message(role, content, sources=None):
         st.markdown(content)
         
         if sources:
-            with st.expander("View Sources / Raw Data"):
-                for i, s in enumerate(sources):
-                    st.caption(f"**Source {i+1}:** `{s.get('source', 'Unknown')}`")
-                    
-                    if s.get("type") == "sql":
-                        try:
-                            df = pd.DataFrame(s["content"])
-                            st.dataframe(df)
-                        except Exception:
-                            st.code(str(s["content"]))
-                    else:
-                        st.text(s["content"])
-                    
-                    st.divider()
+            render_sources(sources, msg_id)
 
 # Loop through history
-for msg in st.session_state.messages:
-    render_message(msg["role"], msg["content"], msg.get("sources"))
+with st.container():
+    for msg_id, msg in enumerate(st.session_state.messages):
+        render_message(msg["role"], msg["content"], msg.get("sources"), msg_id)
 
 # --- Chat Input ---
 query = st.chat_input("Ask NuPIE Insights...")
@@ -79,8 +115,14 @@ if query:
     st.session_state.messages.append({"role": "user", "content": query, "sources": []})
     render_message("user", query)
 
-    with st.spinner("Analyzing databases and documents..."):
-        answer, sources = pipeline.ask(query)
+    # Stream the answer so the first tokens show up as soon as the LLM produces them
+    with st.chat_message("assistant", avatar=LOGO_PATH):
+        with st.spinner("Analyzing databases and documents..."):
+            stream, sources = pipeline.ask_stream(query)
+        answer = st.write_stream(stream)
+        
+        if sources:
+            # Same id the message gets in history, so an opened toggle stays open
+            render_sources(sources, len(st.session_state.messages))
 
-    st.session_state.messages.append({"role": "assistant", "content": answer, "sources": sources})
-    render_message("assistant", answer, sources)
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": answer, "sources": sources})
\ No newline at end of file
@@ -1,7 +1,9 @@
 # db_setup.py
 import os
 import re
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy import create_engine, text
 import pandas as pd
 
@@ -9,18 +11,37 @@ import pandas as pd
 DOCS_DIR = "docs"
 ANCHOR_DB_FILE = "agent_data.db"
 ANCHOR_DB_URI = f"sqlite:///{ANCHOR_DB_FILE}"
+SQL_BATCH_STATEMENTS = 100
+DATA_FILE_SUFFIXES = ['.sql', '.csv', '.xlsx', '.xls']
+# Worker start-up (spawn re-imports pandas/SQLAlchemy) only pays off for larger inputs
+PARALLEL_MIN_FILES = 2
+PARALLEL_MIN_BYTES = 50 * 1024 * 1024
 # -----------------------------------
 
+# ---------- Precompiled Patterns ----------
+_MYSQL_DIRECTIVE_RE = re.compile(r'/\*!.*?\*/;', re.DOTALL)
+_LINE_COMMENT_RE = re.compile(r'^--.*$', re.MULTILINE)
+_INT_RE = re.compile(r'(tiny|small|medium|big)?int\s*\(\s*\d+\s*\)', re.IGNORECASE)
+_DOUBLE_RE = re.compile(r'\bdouble\b', re.IGNORECASE)
+_FLOAT_RE = re.compile(r'\bfloat\b', re.IGNORECASE)
+_TABLE_OPTIONS_RE = re.compile(r'\)\s*(ENGINE|AUTO_INCREMENT|DEFAULT CHARSET)=[^;]*;', re.IGNORECASE)
+_LOCK_TABLES_RE = re.compile(r'(LOCK|UNLOCK) TABLES.*?;', re.IGNORECASE)
+_STATEMENT_END_RE = re.compile(r';\s*$', re.MULTILINE)
+_TRANSACTION_RE = re.compile(r'^(BEGIN|COMMIT|ROLLBACK|START TRANSACTION)\b', re.IGNORECASE)
+_NONALNUM_RE = re.compile(r'[^a-z0-9]')
+_UNDERSCORES_RE = re.compile(r'_+')
+# ------------------------------------------
+
 def _sanitize_mysql_for_sqlite(sql_script: str) -> str:
     """Cleans MySQL specific syntax to work with SQLite."""
-    script = re.sub(r'/\*!.*?\*/;', '', sql_script, flags=re.DOTALL)
-    script = re.sub(r'^--.*$', '', script, flags=re.MULTILINE)
+    script = _MYSQL_DIRECTIVE_RE.sub('', sql_script)
+    script = _LINE_COMMENT_RE.sub('', script)
     script = script.replace('`', '')
-    script = re.sub(r'(tiny|small|medium|big)?int\s*\(\s*\d+\s*\)', 'INTEGER', script, flags=re.IGNORECASE)
-    script = re.sub(r'\bdouble\b', 'REAL', script, flags=re.IGNORECASE)
-    script = re.sub(r'\bfloat\b', 'REAL', script, flags=re.IGNORECASE)
-    script = re.sub(r'\)\s*(ENGINE|AUTO_INCREMENT|DEFAULT CHARSET)=[^;]*;', ');', script, flags=re.IGNORECASE)
-    script = re.sub(r'(LOCK|UNLOCK) TABLES.*?;', '', script, flags=re.IGNORECASE)
+    script = _INT_RE.sub('INTEGER', script)
+    script = _DOUBLE_RE.sub('REAL', script)
+    script = _FLOAT_RE.sub('REAL', script)
+    script = _TABLE_OPTIONS_RE.sub(');', script)
+    script = _LOCK_TABLES_RE.sub('', script)
     return script
 
 def _clean_col_name(col_name: str) -> str:
@@ -35,10 +56,10 @@ def _clean_col_name(col_name: str) -> str:
     clean = str(col_name).lower().strip()
     
     # 2. Replace everything that isn't a-z or 0-9 with an underscore
-    clean = re.sub(r'[^a-z0-9]', '_', clean)
+    clean = _NONALNUM_RE.sub('_', clean)
     
     # 3. Collapse multiple underscores (e.g., "a___b" -> "a_b")
-    clean = re.sub(r'_+', '_', clean)
+    clean = _UNDERSCORES_RE.sub('_', clean)
     
     # 4. Strip leading/trailing underscores
     clean = clean.strip('_')
@@ -48,6 +69,110 @@ def _clean_col_name(col_name: str) -> str:
     
     return clean
 
+def _clean_col_names(columns) -> pd.Index:
+    """
+    Vectorized _clean_col_name over a whole column index.
+    Names that collide after cleaning ('Score' / 'score ') get _1, _2... suffixes,
+    since to_sql rejects duplicate column names.
+    """
+    clean = (
+        pd.Index(columns).astype(str).str.lower().str.strip()
+        .str.replace(_NONALNUM_RE, '_', regex=True)
+        .str.replace(_UNDERSCORES_RE, '_', regex=True)
+        .str.strip('_')
+    )
+    clean = clean.where(clean != '', 'unnamed_col')
+
+    names, used = [], set()
+    for name in clean:
+        candidate, n = name, 0
+        while candidate in used:
+            n += 1
+            candidate = f"{name}_{n}"
+        used.add(candidate)
+        names.append(candidate)
+    return pd.Index(names)
+
+def _execute_sql_statements(engine, statements: list) -> int:
+    """
+    Runs statements through the raw sqlite3 connection in batches via executescript.
+    A failing batch is rolled back and replayed one statement at a time so a single
+    bad statement does not drop the rest of its batch.
+    """
+    count = 0
+    raw_conn = engine.raw_connection()
+    try:
+        db = raw_conn.driver_connection
+        for i in range(0, len(statements), SQL_BATCH_STATEMENTS):
+            batch = statements[i:i + SQL_BATCH_STATEMENTS]
+            try:
+                db.executescript("BEGIN;\n" + ";\n".join(batch) + ";\nCOMMIT;")
+                count += len(batch)
+            except Exception:
+                db.rollback()
+                for stmt in batch:
+                    try:
+                        db.execute(stmt)
+                        count += 1
+                    except Exception: pass
+                db.commit()
+    finally:
+        raw_conn.close()
+    return count
+
+def _process_one_file(file_path: Path):
+    """Builds the isolated SQLite DB for a single data file. Runs in a worker process."""
+    specific_db_name = file_path.stem + ".db"
+    specific_db_path = file_path.parent / specific_db_name
+    
+    # Ensure fresh start for every DB
+    if specific_db_path.exists():
+        try: os.remove(specific_db_path)
+        except Exception: pass
+
+    specific_uri = f"sqlite:///{specific_db_path}"
+    engine = create_engine(specific_uri)
+    print(f"[DB Setup] Processing: {file_path.name} -> {specific_db_name}")
+
+    try:
+        # A. Handle SQL Files
+        if file_path.suffix.lower() == '.sql':
+            raw = file_path.read_text(encoding='utf-8-sig')
+            clean = _sanitize_mysql_for_sqlite(raw)
+            # Transactions are managed per batch, so the dump's own BEGIN/COMMIT are dropped
+            statements = [
+                s.strip() for s in _STATEMENT_END_RE.split(clean)
+                if s.strip() and not _TRANSACTION_RE.match(s.strip())
+            ]
+            count = _execute_sql_statements(engine, statements)
+            print(f"    - Executed {count} SQL statements.")
+
+        # B. Handle CSV/Excel (With Column Normalization)
+        elif file_path.suffix.lower() in ['.csv', '.xlsx', '.xls']:
+            # Read Data
+            if file_path.suffix.lower() == '.csv':
+                df = pd.read_csv(file_path)
+            else:
+                df = pd.read_excel(file_path)
+            
+            # --- NORMALIZE COLUMNS ---
+            old_cols = list(df.columns)
+            df.columns = _clean_col_names(df.columns)
+            new_cols = list(df.columns)
+            
+            # Sanitize Table Name
+            table_name = _clean_col_name(file_path.stem)
+            
+            # Write to DB
+            df.to_sql(table_name, engine, index=False, if_exists='replace')
+            print(f"    - Table '{table_name}' created ({len(df)} rows).")
+            print(f"    - Columns normalized (e.g., '{old_cols[0]}' -> '{new_cols[0]}')")
+
+    except Exception as e:
+        print(f"    [!] Error processing {file_path.name}: {e}")
+    finally:
+        engine.dispose()
+
 def create_database_from_sql_files(db_uri: str = ANCHOR_DB_URI):
     docs_path = Path(DOCS_DIR)
     
@@ -65,66 +190,27 @@ def create_database_from_sql_files(db_uri: str = ANCHOR_DB_URI):
     # --- 2. Process Files ---
     all_files = sorted([
         f for f in docs_path.iterdir() 
-        if f.suffix.lower() in ['.sql', '.csv', '.xlsx', '.xls']
+        if f.suffix.lower() in DATA_FILE_SUFFIXES
     ])
 
     if not all_files:
         print("[DB Setup] No data files found in docs/.")
         return ANCHOR_DB_URI
 
-    for file_path in all_files:
-        specific_db_name = file_path.stem + ".db"
-        specific_db_path = docs_path / specific_db_name
-        
-        # Ensure fresh start for every DB
-        if specific_db_path.exists():
-            try: os.remove(specific_db_path)
-            except Exception: pass
-
-        specific_uri = f"sqlite:///{specific_db_path}"
-        engine = create_engine(specific_uri)
-        print(f"[DB Setup] Processing: {file_path.name} -> {specific_db_name}")
-
+    # Every file gets its own DB, so large inputs are processed in parallel.
+    # "spawn" avoids forking the (multi-threaded) Streamlit server process.
+    workers = min(len(all_files), os.cpu_count() or 1)
+    total_bytes = sum(f.stat().st_size for f in all_files)
+    if workers >= PARALLEL_MIN_FILES and total_bytes >= PARALLEL_MIN_BYTES:
         try:
-            # A. Handle SQL Files
-            if file_path.suffix.lower() == '.sql':
-                with engine.connect() as conn:
-                    raw = file_path.read_text(encoding='utf-8-sig')
-                    clean = _sanitize_mysql_for_sqlite(raw)
-                    statements = re.split(r';\s*$', clean, flags=re.MULTILINE)
-                    count = 0
-                    for stmt in statements:
-                        if stmt.strip():
-                            try:
-                                conn.execute(text(stmt.strip()))
-                                count += 1
-                            except Exception: pass
-                    conn.commit()
-                print(f"    - Executed {count} SQL statements.")
-
-            # B. Handle CSV/Excel (With Column Normalization)
-            elif file_path.suffix.lower() in ['.csv', '.xlsx', '.xls']:
-                # Read Data
-                if file_path.suffix.lower() == '.csv':
-                    df = pd.read_csv(file_path)
-                else:
-                    df = pd.read_excel(file_path)
-                
-                # --- NORMALIZE COLUMNS ---
-                old_cols = list(df.columns)
-                df.columns = [_clean_col_name(c) for c in df.columns]
-                new_cols = list(df.columns)
-                
-                # Sanitize Table Name
-                table_name = _clean_col_name(file_path.stem)
-                
-                # Write to DB
-                df.to_sql(table_name, engine, index=False, if_exists='replace')
-                print(f"    - Table '{table_name}' created ({len(df)} rows).")
-                print(f"    - Columns normalized (e.g., '{old_cols[0]}' -> '{new_cols[0]}')")
-
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+                list(ex.map(_process_one_file, all_files))
         except Exception as e:
-            print(f"    [!] Error processing {file_path.name}: {e}")
+            print(f"[DB Setup] Parallel processing failed ({e}). Falling back to sequential.")
+            for file_path in all_files: _process_one_file(file_path)
+    else:
+        for file_path in all_files: _process_one_file(file_path)
 
     print("[DB Setup] Database generation complete.")
     return ANCHOR_DB_URI
@@ -1,6 +1,7 @@
 # ingest.py
 from pathlib import Path
 import os
+import json
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_unstructured import UnstructuredLoader 
 from langchain_community.vectorstores.utils import filter_complex_metadata 
@@ -9,11 +10,14 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
+from db_setup import DATA_FILE_SUFFIXES
 
 # OCR Handling
 try:
     from pdf2image import convert_from_path
     import pytesseract
+    from PIL import ImageStat
     OCR_AVAILABLE = True
 except Exception:
     OCR_AVAILABLE = False
@@ -21,14 +25,34 @@ except Exception:
 # --------- Configuration ----------
 DOCS_DIR = "docs"
 DB_DIR = "chroma_db"
+MANIFEST_FILE = os.path.join(DB_DIR, ".manifest")
+
+# Document types that are embedded (structured data goes to SQL)
+PDF_SUFFIXES = [".pdf"]
+TEXT_SUFFIXES = [".txt"]
+UNSTRUCTURED_SUFFIXES = [".doc", ".docx", ".ppt", ".pptx", ".html", ".htm"]
+DOC_SUFFIXES = PDF_SUFFIXES + TEXT_SUFFIXES + UNSTRUCTURED_SUFFIXES
 
 # EMBEDDINGS = LOCAL (Stable, Free)
 EMBEDDING_MODEL = "embeddinggemma:latest" 
 
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 64
+
+OCR_DPI = 200
+OCR_BLANK_STDDEV = 5 # Grayscale std-dev below this is treated as a blank page
 # ----------------------------------
 
+def _ocr_page(img) -> str:
+    # Skip near-uniform (blank) pages before paying for tesseract
+    try:
+        if ImageStat.Stat(img.convert('L')).stddev[0] < OCR_BLANK_STDDEV:
+            return ""
+        return pytesseract.image_to_string(img)
+    except Exception:
+        return ""
+
 def ocr_pdf_to_documents(pdf_path):
     docs = []
     if not OCR_AVAILABLE:
@@ -36,34 +60,39 @@ def ocr_pdf_to_documents(pdf_path):
         return docs
 
     print(f"[ingest][ocr] Running OCR fallback on {pdf_path} ...")
+    workers = os.cpu_count() or 1
     try:
         with TemporaryDirectory() as tmpdir:
-            images = convert_from_path(pdf_path, dpi=200, output_folder=tmpdir)
-            for i, img in enumerate(images):
-                try:
-                    text = pytesseract.image_to_string(img)
-                    if text.strip():
-                        docs.append(Document(page_content=text, metadata={"source": Path(pdf_path).name}))
-                except Exception: pass
+            images = convert_from_path(pdf_path, dpi=OCR_DPI, output_folder=tmpdir, thread_count=workers)
+            # tesseract runs as a subprocess, so threads give real parallelism here
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                texts = list(ex.map(_ocr_page, images))
+            for text in texts:
+                if text.strip():
+                    docs.append(Document(page_content=text, metadata={"source": Path(pdf_path).name}))
     except Exception as e:
         print(f"[ingest][ocr] Failed to OCR {pdf_path}: {e}")
     return docs
 
-def load_all_documents():
+def load_all_documents(files=None, failed=None):
+    """
+    Loads every file in docs/, or only `files` when given.
+    Names of files that could not be loaded are appended to `failed` if provided.
+    """
     docs = []
     path = Path(DOCS_DIR)
 
     if not path.exists():
         raise ValueError(f"Docs directory {DOCS_DIR} does not exist.")
 
-    for file in sorted(path.iterdir()):
+    for file in sorted(files if files is not None else path.iterdir()):
         try:
             suffix = file.suffix.lower()
-            if suffix in ['.sql', '.csv', '.xls', '.xlsx']:
+            if suffix in DATA_FILE_SUFFIXES:
                 print(f"[ingest] Skipping structured data file: {file.name}")
                 continue
 
-            if suffix == ".pdf":
+            if suffix in PDF_SUFFIXES:
                 print(f"[ingest] Loading PDF → {file.name}")
                 try:
                     pdf_docs = PyPDFLoader(str(file)).load()
@@ -76,15 +105,16 @@ def load_all_documents():
                     docs.extend(pdf_docs)
                 except Exception:
                     ocr_docs = ocr_pdf_to_documents(str(file))
+                    if not ocr_docs and failed is not None: failed.append(file.name)
                     docs.extend(ocr_docs)
 
-            elif suffix == ".txt":
+            elif suffix in TEXT_SUFFIXES:
                 print(f"[ingest] Loading TXT → {file.name}")
                 txt_docs = TextLoader(str(file), encoding='utf-8', autodetect_encoding=True).load()
                 for d in txt_docs: d.metadata["source"] = file.name
                 docs.extend(txt_docs)
 
-            elif suffix in [".doc", ".docx", ".ppt", ".pptx", ".html", ".htm"]:
+            elif suffix in UNSTRUCTURED_SUFFIXES:
                 print(f"[ingest] Loading Unstructured → {file.name}")
                 other_docs = UnstructuredLoader(str(file)).load()
                 for d in other_docs: d.metadata["source"] = file.name
@@ -92,6 +122,7 @@ def load_all_documents():
 
         except Exception as e:
             print(f"[ingest] Failed to load {file.name}: {e}")
+            if failed is not None: failed.append(file.name)
 
     print(f"[ingest] Loaded {len(docs)} raw document sections.")
     return docs
@@ -102,7 +133,7 @@ def split_into_chunks(docs):
     print(f"[ingest] Created {len(chunks)} chunks.")
     return chunks
 
-def build_vectorstore(chunks):
+def build_vectorstore(chunks, embeddings=None, vectordb=None):
     if not chunks:
         print("[ingest] No chunks to ingest.")
         return None
@@ -110,22 +141,75 @@ def build_vectorstore(chunks):
     print(f"[ingest] Building embeddings locally ({EMBEDDING_MODEL})...")
     
     # FIX: No 'headers' or 'base_url' passed here. Defaults to http://localhost:11434
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+    if embeddings is None:
+        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+
+    if vectordb is None:
+        vectordb = Chroma(persist_directory=DB_DIR, embedding_function=embeddings)
+
+    # Bounded batches keep each embedding request (and progress output) a reasonable size
+    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+        vectordb.add_documents(chunks[start:start + EMBED_BATCH_SIZE])
+        print(f"[ingest] Embedded {min(start + EMBED_BATCH_SIZE, len(chunks))}/{len(chunks)} chunks.")
 
-    vectordb = Chroma.from_documents(chunks, embeddings, persist_directory=DB_DIR)
     print("[ingest] Chroma DB built and persisted.")
     return vectordb
 
-def run_ingestion_if_needed():
-    if not os.path.exists(DB_DIR) or not os.listdir(DB_DIR):
-        print("[ingest] No Vector DB found → Running ingestion...")
-        docs = load_all_documents()
+def _scan_docs() -> dict:
+    """{file name: [mtime_ns, size]} for every embeddable file in docs/."""
+    path = Path(DOCS_DIR)
+    if not path.exists(): return {}
+    manifest = {}
+    for file in sorted(path.iterdir()):
+        if file.is_file() and file.suffix.lower() in DOC_SUFFIXES:
+            st = file.stat()
+            manifest[file.name] = [st.st_mtime_ns, st.st_size]
+    return manifest
+
+def _read_manifest() -> dict:
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _write_manifest(manifest: dict):
+    os.makedirs(DB_DIR, exist_ok=True)
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+def run_ingestion_if_needed(embeddings=None):
+    current = _scan_docs()
+    previous = _read_manifest() if os.path.exists(DB_DIR) else {}
+
+    if current == previous and os.path.exists(DB_DIR):
+        print("[ingest] Vector DB up to date → Skipping ingestion.")
+        return
+
+    # Only new/modified files are re-embedded; removed files are just dropped
+    changed = [name for name in current if previous.get(name) != current[name]]
+    removed = [name for name in previous if name not in current]
+    print(f"[ingest] Docs changed → Re-ingesting {len(changed)} file(s), removing {len(removed)}.")
+
+    if embeddings is None:
+        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+    vectordb = Chroma(persist_directory=DB_DIR, embedding_function=embeddings)
+
+    # Drop stale chunks (also clears chunks left by a run that predates the manifest)
+    stale = changed + removed
+    if stale:
+        vectordb.delete(where={"source": {"$in": stale}})
+
+    failed = []
+    if changed:
+        docs = load_all_documents(files=[Path(DOCS_DIR) / name for name in changed], failed=failed)
         if docs:
             chunks = split_into_chunks(docs)
             chunks = filter_complex_metadata(chunks)
-            build_vectorstore(chunks)
-    else:
-        print("[ingest] Vector DB exists → Skipping ingestion.")
+            build_vectorstore(chunks, embeddings, vectordb)
+
+    # Files that failed to load stay out of the manifest so the next run retries them
+    _write_manifest({name: stamp for name, stamp in current.items() if name not in failed})
 
 if __name__ == "__main__":
     run_ingestion_if_needed()
\ No newline at end of file
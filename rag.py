@@ -1,7 +1,9 @@
 # rag.py
 import re
+from functools import lru_cache
 from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
 from ingest import run_ingestion_if_needed
 from sql_agent import SQLAgent
 from db_setup import create_database_from_sql_files, ANCHOR_DB_URI
@@ -16,58 +18,113 @@ EMBEDDING_MODEL = "embeddinggemma:latest"
 
 CHROMA_DB_DIR = "chroma_db"
 LLM_TEMPERATURE = 0.0
+QUERY_EMBED_CACHE_SIZE = 512
 # -----------------------------------
 
+# EXPANDED KEYWORD LIST (routes a query to the SQL agent)
+SQL_KEYWORDS = [
+    # Basic Math
+    "total", "sum", "average", "count", "max", "min", "calculate", "value",
+    # Listing/Tables
+    "list", "table", "show me", "how many",
+    # Analysis
+    "distribution", "breakdown", "percentage", "proportion", "ratio", 
+    "trend", "compare", "difference", "highest", "lowest", "rank", 
+    "top", "bottom", "common", "popular"
+]
+# Single-pass, case-insensitive substring match over all keywords
+_SQL_KEYWORD_RE = re.compile("|".join(map(re.escape, SQL_KEYWORDS)), re.IGNORECASE)
+_WS_RE = re.compile(r'\s+')
+
+def create_sql_agent(llm: ChatOllama = None) -> SQLAgent:
+    """Rebuilds the per-file SQLite DBs and attaches them to a fresh SQL agent."""
+    print("[INIT] Setting up isolated SQL databases...")
+    anchor_db_uri = create_database_from_sql_files(ANCHOR_DB_URI)
+    return SQLAgent(
+        db_uri=anchor_db_uri,
+        llm_model=LLM_MODEL,
+        llm_temperature=LLM_TEMPERATURE,
+        base_url=OLLAMA_URL,
+        llm=llm
+    )
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embeddings client with an LRU cache on embed_query, so repeated
+    questions skip the round-trip to Ollama.
+    Document embedding is passed through uncached.
+    """
+    def __init__(self, inner: Embeddings, maxsize: int = QUERY_EMBED_CACHE_SIZE):
+        self.inner = inner
+        self._embed_query_cached = lru_cache(maxsize=maxsize)(self._embed_query)
+
+    def _embed_query(self, text: str) -> tuple:
+        return tuple(self.inner.embed_query(text))
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        return list(self._embed_query_cached(text))
+
+def create_embeddings() -> CachedQueryEmbeddings:
+    print(f"[INIT] Connecting to Embeddings: {EMBEDDING_MODEL}...")
+    return CachedQueryEmbeddings(OllamaEmbeddings(
+        model=EMBEDDING_MODEL,
+        base_url=OLLAMA_URL
+    ))
+
+def load_chroma(embeddings) -> Chroma:
+    """Brings the vector store up to date with docs/, then opens the persisted Chroma DB."""
+    run_ingestion_if_needed(embeddings)
+    print("[INIT] Loading persisted Chroma DB...")
+    return Chroma(
+        persist_directory=CHROMA_DB_DIR,
+        embedding_function=embeddings
+    )
+
+def create_llm() -> ChatOllama:
+    print(f"[INIT] Connecting to LLM: {LLM_MODEL}...")
+    return ChatOllama(
+        model=LLM_MODEL, 
+        temperature=LLM_TEMPERATURE,
+        base_url=OLLAMA_URL
+    )
+
 class RAGPipeline:
     def __init__(self):
-        print("[INIT] Setting up isolated SQL databases...")
-        self.anchor_db_uri = create_database_from_sql_files(ANCHOR_DB_URI)
-        run_ingestion_if_needed()
-
-        # 1. Embeddings (Local)
-        print(f"[INIT] Connecting to Embeddings: {EMBEDDING_MODEL}...")
-        self.embeddings = OllamaEmbeddings(
-            model=EMBEDDING_MODEL,
-            base_url=OLLAMA_URL
-        )
-
-        print("[INIT] Loading persisted Chroma DB...")
-        self.db = Chroma(
-            persist_directory=CHROMA_DB_DIR,
-            embedding_function=self.embeddings
-        )
-
-        # 2. LLM (Proxied)
-        print(f"[INIT] Connecting to LLM: {LLM_MODEL}...")
-        self.llm = ChatOllama(
-            model=LLM_MODEL, 
-            temperature=LLM_TEMPERATURE,
-            base_url=OLLAMA_URL
-        )
-
-        # 3. SQL Agent
-        self.sql_agent = SQLAgent(
-            db_uri=self.anchor_db_uri,
-            llm_model=LLM_MODEL,
-            llm_temperature=LLM_TEMPERATURE,
-            base_url=OLLAMA_URL
-        )
+        # One LLM and one embeddings client are shared by every component, so each
+        # Ollama endpoint is reached through a single keep-alive connection pool.
+        # 1. LLM (Proxied)
+        self.llm = create_llm()
+
+        # 2. SQL Agent (Isolated DBs)
+        self.sql_agent = create_sql_agent(self.llm)
+        self.anchor_db_uri = self.sql_agent.db_uri
+
+        # 3. Embeddings (Local) + Vector Store
+        self.embeddings = create_embeddings()
+        self.db = load_chroma(self.embeddings)
+
+    @classmethod
+    def from_parts(cls, embeddings, db, llm, sql_agent):
+        """Assembles a pipeline from pre-built resources (e.g. separately cached by Streamlit)."""
+        pipeline = cls.__new__(cls)
+        pipeline.sql_agent = sql_agent
+        pipeline.anchor_db_uri = sql_agent.db_uri
+        pipeline.embeddings = embeddings
+        pipeline.db = db
+        pipeline.llm = llm
+        return pipeline
 
     def _is_sql_query(self, query: str) -> bool:
-        # EXPANDED KEYWORD LIST
-        keywords = [
-            # Basic Math
-            "total", "sum", "average", "count", "max", "min", "calculate", "value",
-            # Listing/Tables
-            "list", "table", "show me", "how many",
-            # Analysis
-            "distribution", "breakdown", "percentage", "proportion", "ratio", 
-            "trend", "compare", "difference", "highest", "lowest", "rank", 
-            "top", "bottom", "common", "popular"
-        ]
-        return any(kw in query.lower() for kw in keywords)
+        return bool(_SQL_KEYWORD_RE.search(query))
 
-    def ask(self, query):
+    def _route(self, query):
+        """
+        Runs routing + retrieval. Returns (answer, sources, messages): `answer` is final
+        for the SQL and no-document paths, otherwise `messages` still needs the LLM.
+        """
         used_sql = False
         
         # --- PATH 1: SQL ---
@@ -81,7 +138,7 @@ class RAGPipeline:
             if not is_empty and not is_error:
                 print("[Router] SQL Agent success.")
                 sources = [{"type": "sql", "source": source_file, "content": raw_rows}]
-                return summary, sources
+                return summary, sources, None
             
             print(f"[Router] SQL Agent returned no data/failure. Falling back to RAG...")
             used_sql = True
@@ -89,13 +146,13 @@ class RAGPipeline:
         # --- PATH 2: RAG ---
         print(f"[Router] Routing to Document RAG: {query!r}")
         try:
-            docs = self.db.similarity_search(query, k=4)
+            docs = self.db.similarity_search_by_vector(self.embeddings.embed_query(query), k=4)
         except Exception:
             docs = []
 
         if not docs:
             fallback = " (SQL also found no data)." if used_sql else "."
-            return f"I couldn't find relevant information in the documents{fallback}", []
+            return f"I couldn't find relevant information in the documents{fallback}", [], None
 
         context_str = "\n\n".join([f"Source: {d.metadata.get('source', 'unknown')}\n{d.page_content}" for d in docs])
 
@@ -104,15 +161,29 @@ class RAGPipeline:
             {"role": "user", "content": f"Context:\n{context_str}\n\nQuestion: {query}"}
         ]
 
-        response = self.llm.invoke(messages).content
-
         sources = []
         for d in docs:
-            preview = re.sub(r'\s+', ' ', d.page_content).strip()[:400] + "..."
+            # Only the head of the chunk is shown, so only the head is normalized
+            preview = _WS_RE.sub(' ', d.page_content[:500]).strip()[:400] + "..."
             sources.append({
                 "type": "text",
                 "source": d.metadata.get("source", "unknown"),
                 "content": preview
             })
 
-        return response, sources
\ No newline at end of file
+        return None, sources, messages
+
+    def ask(self, query):
+        answer, sources, messages = self._route(query)
+        if messages is None: return answer, sources
+        return self.llm.invoke(messages).content, sources
+
+    def ask_stream(self, query):
+        """Like ask(), but the answer is a generator of text chunks (for st.write_stream)."""
+        answer, sources, messages = self._route(query)
+        if messages is None: return iter([answer]), sources
+        return self._stream(messages), sources
+
+    def _stream(self, messages):
+        for chunk in self.llm.stream(messages):
+            yield chunk.content
\ No newline at end of file
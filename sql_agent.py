@@ -1,13 +1,26 @@
 # sql_agent.py
+import os
 import re
-from sqlalchemy import create_engine, text
+import json
+from collections import Counter
+from sqlalchemy import create_engine, inspect, text
 from langchain_ollama import ChatOllama
 from pathlib import Path
+from db_setup import DATA_FILE_SUFFIXES
+
+# ---------- Configuration ----------
+SCHEMA_CACHE_FILE = ".schema_cache.json"
+SCHEMA_SEPARATOR = "\n---------------------\n"
+SCHEMA_SAMPLE_ROWS = 2000
+MAX_RESULT_ROWS = 20 # Rows returned to the UI
+SUMMARY_PREVIEW_ROWS = 8 # Rows shown to the LLM for summarization
+# -----------------------------------
 
 class SQLAgent:
-    def __init__(self, db_uri: str, llm_model: str, llm_temperature: float, base_url: str = None):
+    def __init__(self, db_uri: str, llm_model: str, llm_temperature: float, base_url: str = None, llm: ChatOllama = None):
         self.db_uri = db_uri
         self.attached_dbs = [] 
+        self.attached_paths = {}
         
         try:
             self.engine = create_engine(db_uri)
@@ -18,15 +31,21 @@ class SQLAgent:
 
         self._attach_external_databases()
 
-        print(f"[SQL] Initializing LLM: {llm_model} (URL: {base_url})")
-        self.llm = ChatOllama(
-            model=llm_model, 
-            temperature=llm_temperature,
-            base_url=base_url
-        )
+        # Reuse the caller's client when given, so both share one HTTP connection pool
+        if llm is not None:
+            self.llm = llm
+        else:
+            print(f"[SQL] Initializing LLM: {llm_model} (URL: {base_url})")
+            self.llm = ChatOllama(
+                model=llm_model, 
+                temperature=llm_temperature,
+                base_url=base_url
+            )
         
         print("[SQL] Building Value-Aware Schema Map...")
         self.schema_map = self._build_value_aware_schema_map()
+        # The schema is static for the agent's lifetime, so the prompt prefix is built once
+        self._sql_prompt_prefix = self._build_sql_prompt_prefix()
 
     def _attach_external_databases(self):
         docs_dir = Path("docs")
@@ -41,41 +60,110 @@ class SQLAgent:
                 try:
                     conn.execute(text(f"ATTACH DATABASE '{db_path}' AS {alias}"))
                     self.attached_dbs.append(alias)
+                    self.attached_paths[alias] = db_path
                 except Exception: pass
 
-    def _build_value_aware_schema_map(self):
+    def _load_schema_cache(self) -> dict:
+        try:
+            with open(SCHEMA_CACHE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_schema_cache(self, cache: dict):
+        try:
+            with open(SCHEMA_CACHE_FILE, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        except Exception as e:
+            print(f"[SQL] Could not write schema cache: {e}")
+
+    def _fingerprint(self, alias: str):
+        """
+        (path, mtime, size) of the data file an attached DB was built from.
+        db_setup rebuilds every DB on startup, so the DB's own mtime is useless as a key;
+        DBs with no source file next to them fall back to the DB file itself.
+        """
+        db_path = self.attached_paths.get(alias)
+        path = db_path
+        for suffix in DATA_FILE_SUFFIXES:
+            source = Path(db_path).with_suffix(suffix)
+            if source.exists():
+                path = str(source).replace("\\", "/")
+                break
+        try:
+            return [path, os.path.getmtime(path), os.path.getsize(path)]
+        except Exception:
+            return None
+
+    def _describe_database(self, conn, alias: str) -> str:
+        """Probes every table of one attached DB for its columns and most common values."""
         schema_info = []
+        try:
+            # Reflect through this connection: ATTACH is per-connection, so a fresh
+            # engine-level inspector would not see the attached schemas
+            insp = inspect(conn)
+            for table in insp.get_table_names(schema=alias):
+                if table.startswith("sqlite_"): continue
+                
+                cols = insp.get_columns(table, schema=alias)
+
+                # One sampled scan per table; top values per column are counted in Python
+                try:
+                    sample = conn.execute(text(f'SELECT * FROM {alias}."{table}" LIMIT {SCHEMA_SAMPLE_ROWS}')).fetchall()
+                except Exception:
+                    sample = []
+
+                col_details = []
+                for idx, c in enumerate(cols):
+                    col_name = c["name"]
+                    example_vals = ""
+                    try:
+                        counts = Counter(row[idx] for row in sample if row[idx] is not None)
+                        vals = [str(v) for v, _ in counts.most_common(3)]
+                        if vals:
+                            clean_vals = [v[:15] + "..." if len(v) > 15 else v for v in vals]
+                            example_vals = f" (e.g. {', '.join(clean_vals)})"
+                    except: pass
+                    col_details.append(f"- {col_name}{example_vals}")
+
+                info = (f"TABLE: `{alias}.{table}`\nCOLUMNS:\n" + "\n".join(col_details))
+                schema_info.append(info)
+        except Exception: pass
+        return SCHEMA_SEPARATOR.join(schema_info)
+
+    def _build_value_aware_schema_map(self):
         if not self.attached_dbs: return "(No tables found)"
 
+        # Reuse cached blocks for DB files that have not changed since the last probe
+        cache = self._load_schema_cache()
+        dirty = False
+        blocks = []
+
         with self.engine.connect() as conn:
             for alias in self.attached_dbs:
-                try:
-                    tables = conn.execute(text(f"SELECT name FROM {alias}.sqlite_master WHERE type='table'")).fetchall()
-                    for t_row in tables:
-                        table = t_row[0]
-                        if table.startswith("sqlite_"): continue
-                        
-                        cols = conn.execute(text(f"PRAGMA {alias}.table_info('{table}')")).fetchall()
-                        col_details = []
-                        for c in cols:
-                            col_name = c[1]
-                            example_vals = ""
-                            try:
-                                q = text(f"SELECT {col_name}, COUNT(*) as c FROM {alias}.{table} GROUP BY {col_name} ORDER BY c DESC LIMIT 3")
-                                res = conn.execute(q).fetchall()
-                                vals = [str(r[0]) for r in res if r[0] is not None]
-                                if vals:
-                                    clean_vals = [v[:15] + "..." if len(v) > 15 else v for v in vals]
-                                    example_vals = f" (e.g. {', '.join(clean_vals)})"
-                            except: pass
-                            col_details.append(f"- {col_name}{example_vals}")
-
-                        info = (f"TABLE: `{alias}.{table}`\nCOLUMNS:\n" + "\n".join(col_details))
-                        schema_info.append(info)
-                except Exception: pass
-        return "\n---------------------\n".join(schema_info)
+                key = self._fingerprint(alias)
+                entry = cache.get(alias)
+                if key is not None and entry and entry.get("key") == key:
+                    block = entry.get("schema", "")
+                else:
+                    print(f"[SQL] Probing schema for {alias}...")
+                    block = self._describe_database(conn, alias)
+                    if key is not None:
+                        cache[alias] = {"key": key, "schema": block}
+                        dirty = True
+                if block: blocks.append(block)
+
+        if dirty: self._save_schema_cache(cache)
+        return SCHEMA_SEPARATOR.join(blocks)
 
     def _clean_sql(self, sql_text: str) -> str:
+        # Fast path: no code fence and the text already starts with the query
+        if "```" not in sql_text:
+            clean = sql_text.strip()
+            first_word = clean.split(None, 1)[0].upper() if clean else ""
+            if first_word in ("SELECT", "WITH"):
+                return clean.replace("`", '"').rstrip(";")
+
         clean = re.sub(r"```sql|```", "", sql_text, flags=re.IGNORECASE).strip()
         match = re.search(r"\b(SELECT|WITH)\b", clean, re.IGNORECASE)
         if match: clean = clean[match.start():]
@@ -83,8 +171,8 @@ class SQLAgent:
         clean = clean.rstrip(";") # Prevents "Multiple statements" error
         return clean
 
-    def _generate_sql(self, query: str) -> str:
-        prompt = (
+    def _build_sql_prompt_prefix(self) -> str:
+        return (
             "You are an expert SQL Data Analyst. Write a SQLite query.\n"
             f"Schema:\n{self.schema_map}\n\n"
             "**CRITICAL RULES:**\n"
@@ -93,14 +181,16 @@ class SQLAgent:
             "3. **Aggregation:** For 'top', 'popular', 'distribution', or 'breakdown', use `GROUP BY column ORDER BY COUNT(*) DESC`.\n"
             "4. **No Hallucinated Filters:** Do NOT add `WHERE` filters unless asked.\n"
             "5. **Output:** Return ONLY the SQL query.\n"
-            f"Question: {query}"
+            "Question: "
         )
-        response = self.llm.invoke(prompt)
+
+    def _generate_sql(self, query: str) -> str:
+        response = self.llm.invoke(self._sql_prompt_prefix + query)
         return self._clean_sql(response.content.strip())
 
     def _summarize_results(self, query: str, results: list) -> str:
         if not results: return "No results found."
-        data_preview = str(results[:8])
+        data_preview = str(results[:SUMMARY_PREVIEW_ROWS])
         prompt = (
             "You are a Data Reporter. Report the data retrieved.\n"
             f"Question: {query}\nData: {data_preview}\n\n"
@@ -118,16 +208,15 @@ class SQLAgent:
                 if alias in sql_query: used_source = f"{alias}.db"; break
 
             with self.engine.connect() as conn:
-                if "limit" not in sql_query.lower(): sql_query += " LIMIT 20"
+                if "limit" not in sql_query.lower(): sql_query += f" LIMIT {MAX_RESULT_ROWS}"
                 
-                result = conn.execute(text(sql_query))
-                keys = result.keys()
-                rows = result.fetchall()
+                # Cap materialized rows even when the generated SQL carries its own larger LIMIT
+                result = conn.execute(text(sql_query)).mappings()
+                structured_data = [dict(m) for m in result.fetchmany(MAX_RESULT_ROWS)]
                 
-            if not rows: return "No data found.", [], used_source
+            if not structured_data: return "No data found.", [], used_source
             
-            structured_data = [dict(zip(keys, row)) for row in rows]
-            print(f"[SQL Agent] Summarizing {len(rows)} rows...")
+            print(f"[SQL Agent] Summarizing {len(structured_data)} rows...")
             summary = self._summarize_results(query, structured_data)
 
             return summary, structured_data, used_source